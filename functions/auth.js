@@ -3,7 +3,9 @@
  * Handles Firebase ID token verification
  */
 
-const { auth } = require('./firebase');
+const firebase = require('./firebase');
+
+const BEARER_PREFIX = 'Bearer ';
 
 /**
  * Verifies Firebase ID token from Authorization header
@@ -12,18 +14,19 @@ const { auth } = require('./firebase');
  * @throws {Error} - If token is invalid or missing
  */
 async function verifyIdToken(authHeader) {
-  if (!authHeader || !authHeader.startsWith('Bearer ')) {
+  if (!authHeader || !authHeader.startsWith(BEARER_PREFIX)) {
     throw new Error('Missing or invalid Authorization header. Expected: Bearer <token>');
   }
 
-  const idToken = authHeader.split('Bearer ')[1];
+  // Prefix is already checked, so slice instead of splitting the header
+  const idToken = authHeader.slice(BEARER_PREFIX.length);
 
   if (!idToken) {
     throw new Error('ID token not found in Authorization header');
   }
 
   try {
-    const decoded = await auth.verifyIdToken(idToken);
+    const decoded = await firebase.auth.verifyIdToken(idToken);
     return {
       uid: decoded.uid,
       decoded
@@ -11,6 +11,9 @@ const functions = require('firebase-functions');
 const STRIPE_SECRET = process.env.STRIPE_SECRET || functions.config().stripe?.secret;
 const STRIPE_PRICE = process.env.STRIPE_PRICE || functions.config().stripe?.price;
 
+// Metered billing unit size (1 unit = 100,000 tokens)
+const TOKENS_PER_UNIT = 100000;
+
 if (!STRIPE_SECRET) {
   console.warn('Warning: STRIPE_SECRET not set. Billing functions will fail.');
 }
@@ -27,20 +30,25 @@ if (STRIPE_SECRET) {
  * Creates a new Stripe customer
  * @param {string} email - Customer email
  * @param {string} uid - Firebase user ID (for metadata)
+ * @param {string} idempotencyKey - Optional Stripe idempotency key for retries of one attempt
  * @returns {Promise<object>} - Stripe customer object
  */
-async function createCustomer(email, uid) {
+async function createCustomer(email, uid, idempotencyKey = null) {
   if (!stripe) {
     throw new Error('Stripe client not initialized. Check STRIPE_SECRET configuration.');
   }
 
+  const params = {
+    email,
+    metadata: {
+      firebase_uid: uid
+    }
+  };
+
   try {
-    const customer = await stripe.customers.create({
-      email,
-      metadata: {
-        firebase_uid: uid
-      }
-    });
+    const customer = idempotencyKey
+      ? await stripe.customers.create(params, { idempotencyKey })
+      : await stripe.customers.create(params);
 
     return customer;
   } catch (error) {
@@ -52,9 +60,10 @@ async function createCustomer(email, uid) {
  * Creates a metered subscription for a customer
  * @param {string} customerId - Stripe customer ID
  * @param {string} priceId - Stripe price ID for metered billing
+ * @param {string} idempotencyKey - Optional Stripe idempotency key for retries of one attempt
  * @returns {Promise<{subscription: object, subscriptionItem: object}>} - Subscription and item
  */
-async function createMeteredSubscription(customerId, priceId = null) {
+async function createMeteredSubscription(customerId, priceId = null, idempotencyKey = null) {
   if (!stripe) {
     throw new Error('Stripe client not initialized. Check STRIPE_SECRET configuration.');
   }
@@ -65,17 +74,21 @@ async function createMeteredSubscription(customerId, priceId = null) {
     throw new Error('Stripe price ID not configured. Set STRIPE_PRICE or pass priceId.');
   }
 
+  const params = {
+    customer: customerId,
+    items: [
+      {
+        price: priceToUse
+      }
+    ],
+    // Metered billing - pay for what you use
+    billing_cycle_anchor: 'now'
+  };
+
   try {
-    const subscription = await stripe.subscriptions.create({
-      customer: customerId,
-      items: [
-        {
-          price: priceToUse
-        }
-      ],
-      // Metered billing - pay for what you use
-      billing_cycle_anchor: 'now'
-    });
+    const subscription = idempotencyKey
+      ? await stripe.subscriptions.create(params, { idempotencyKey })
+      : await stripe.subscriptions.create(params);
 
     // Get the subscription item ID (needed for usage records)
     const subscriptionItem = subscription.items.data[0];
@@ -96,19 +109,19 @@ async function createMeteredSubscription(customerId, priceId = null) {
  * @returns {Promise<object>} - Stripe usage record
  */
 async function reportUsage(subscriptionItemId, tokensUsed) {
-  if (!stripe) {
-    throw new Error('Stripe client not initialized. Check STRIPE_SECRET configuration.');
-  }
-
-  // Convert tokens to units (1 unit = 100,000 tokens)
+  // Convert tokens to units
   // Round up to ensure we bill for partial usage
-  const units = Math.ceil(tokensUsed / 100000);
+  const units = Math.ceil(tokensUsed / TOKENS_PER_UNIT);
 
-  if (units <= 0) {
-    // No usage to report
+  if (!(units > 0)) {
+    // No usage to report (also covers non-numeric tokensUsed, where units is NaN)
     return { quantity: 0, units: 0 };
   }
 
+  if (!stripe) {
+    throw new Error('Stripe client not initialized. Check STRIPE_SECRET configuration.');
+  }
+
   try {
     const usageRecord = await stripe.subscriptionItems.createUsageRecord(
       subscriptionItemId,
@@ -12,12 +12,25 @@ if (!admin.apps.length) {
   admin.initializeApp();
 }
 
-const db = admin.firestore();
-const auth = admin.auth();
+// Firestore and Auth clients are created on first access, so functions
+// that never touch them (e.g. stripeWebhook) don't load them on cold start
+let db = null;
+let auth = null;
 
 module.exports = {
   admin,
-  db,
-  auth
-};
 
+  get db() {
+    if (!db) {
+      db = admin.firestore();
+    }
+    return db;
+  },
+
+  get auth() {
+    if (!auth) {
+      auth = admin.auth();
+    }
+    return auth;
+  }
+};
@@ -5,12 +5,58 @@
 
 const functions = require('firebase-functions');
 const { getAuthenticatedUser } = require('./auth');
-const { getUser, setStripeInfo } = require('./users');
+const { getUser, getCachedUser, setStripeInfo } = require('./users');
 const { callLLM } = require('./llm');
-const { reportUsage } = require('./billing');
+const {
+  createCustomer,
+  createMeteredSubscription,
+  reportUsage,
+  stripe
+} = require('./billing');
 const { logUsage } = require('./usage');
-const { createCustomer, createMeteredSubscription, stripe } = require('./billing');
-const { auth } = require('./firebase');
+
+// Get webhook secret from environment (read once at load, not per delivery)
+const STRIPE_WEBHOOK_SECRET = process.env.STRIPE_WEBHOOK_SECRET ||
+                              functions.config().stripe?.webhook_secret;
+
+// Max length of the client-supplied requestId in createStripeCustomer
+// Keeps `subscription-<uid>-<requestId>` under Stripe's 255-char idempotency key limit
+// (Firebase uids are at most 128 chars)
+const MAX_REQUEST_ID_LENGTH = 64;
+
+// CORS headers shared by the client-facing endpoints
+const CORS_HEADERS = {
+  'Access-Control-Allow-Origin': '*',
+  'Access-Control-Allow-Methods': 'POST, OPTIONS',
+  'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+  // Let browsers reuse a preflight result for an hour
+  'Access-Control-Max-Age': '3600'
+};
+
+/**
+ * Sets CORS headers and answers preflight and non-POST requests
+ * @param {object} req - Express request object
+ * @param {object} res - Express response object
+ * @returns {boolean} - True if the response was already sent
+ */
+function handleCorsAndMethod(req, res) {
+  // Enable CORS
+  res.set(CORS_HEADERS);
+
+  // Handle preflight
+  if (req.method === 'OPTIONS') {
+    res.status(204).end();
+    return true;
+  }
+
+  // Only allow POST
+  if (req.method !== 'POST') {
+    res.status(405).json({ error: 'Method not allowed. Use POST.' });
+    return true;
+  }
+
+  return false;
+}
 
 /**
  * POST /runLLM
@@ -24,20 +70,7 @@ const { auth } = require('./firebase');
  *   { "output": "...", "tokensUsed": 1234, "unitsReported": 1 }
  */
 exports.runLLM = functions.https.onRequest(async (req, res) => {
-  // Enable CORS
-  res.set('Access-Control-Allow-Origin', '*');
-  res.set('Access-Control-Allow-Methods', 'POST, OPTIONS');
-  res.set('Access-Control-Allow-Headers', 'Content-Type, Authorization');
-
-  // Handle preflight
-  if (req.method === 'OPTIONS') {
-    res.status(204).send('');
-    return;
-  }
-
-  // Only allow POST
-  if (req.method !== 'POST') {
-    res.status(405).json({ error: 'Method not allowed. Use POST.' });
+  if (handleCorsAndMethod(req, res)) {
     return;
   }
 
@@ -53,8 +86,8 @@ exports.runLLM = functions.https.onRequest(async (req, res) => {
       return;
     }
 
-    // 3. Load user document from Firestore
-    const user = await getUser(uid);
+    // 3. Load user document (cached per instance)
+    const user = await getCachedUser(uid);
 
     if (!user) {
       res.status(404).json({ error: 'User not found. Please create a Stripe customer first.' });
@@ -77,21 +110,20 @@ exports.runLLM = functions.https.onRequest(async (req, res) => {
     const { output, tokensUsed, model } = llmResponse;
 
     // 6. Save usage to Firestore
+    // Done before billing so a failed write never leaves usage billed but unrecorded
     await logUsage(uid, tokensUsed, model);
 
-    // 7. Convert tokens to units and report to Stripe
-    const units = Math.ceil(tokensUsed / 100000);
+    // 7. Report usage to Stripe
+    // reportUsage converts tokens to units and skips Stripe when there are none
     let unitsReported = 0;
 
-    if (units > 0) {
-      try {
-        await reportUsage(subscriptionItemId, tokensUsed);
-        unitsReported = units;
-      } catch (stripeError) {
-        // Log error but don't fail the request
-        console.error('Failed to report usage to Stripe:', stripeError);
-        // Still return the response, but note the billing failure
-      }
+    try {
+      const { units } = await reportUsage(subscriptionItemId, tokensUsed);
+      unitsReported = units;
+    } catch (stripeError) {
+      // Log error but don't fail the request
+      console.error('Failed to report usage to Stripe:', stripeError);
+      // Still return the response, but note the billing failure
     }
 
     // 8. Return output to client
@@ -117,25 +149,13 @@ exports.runLLM = functions.https.onRequest(async (req, res) => {
  * 
  * Request:
  *   Headers: Authorization: Bearer <firebase_id_token>
+ *   Body (optional): { "requestId": "..." }
  * 
  * Response:
  *   { "customer": {...}, "subscription": {...}, "subscriptionItem": {...} }
  */
 exports.createStripeCustomer = functions.https.onRequest(async (req, res) => {
-  // Enable CORS
-  res.set('Access-Control-Allow-Origin', '*');
-  res.set('Access-Control-Allow-Methods', 'POST, OPTIONS');
-  res.set('Access-Control-Allow-Headers', 'Content-Type, Authorization');
-
-  // Handle preflight
-  if (req.method === 'OPTIONS') {
-    res.status(204).send('');
-    return;
-  }
-
-  // Only allow POST
-  if (req.method !== 'POST') {
-    res.status(405).json({ error: 'Method not allowed. Use POST.' });
+  if (handleCorsAndMethod(req, res)) {
     return;
   }
 
@@ -151,7 +171,20 @@ exports.createStripeCustomer = functions.https.onRequest(async (req, res) => {
       return;
     }
 
-    // 3. Check if user already has Stripe customer
+    // 3. Optional client-generated ID for this signup attempt
+    // Retries that reuse it are deduplicated by Stripe; a new attempt gets a new ID
+    const { requestId } = req.body || {};
+
+    if (requestId !== undefined && (
+      typeof requestId !== 'string' ||
+      !requestId ||
+      requestId.length > MAX_REQUEST_ID_LENGTH
+    )) {
+      res.status(400).json({ error: 'Invalid requestId in request body' });
+      return;
+    }
+
+    // 4. Check if user already has Stripe customer
     const existingUser = await getUser(uid);
     if (existingUser?.stripeCustomerId) {
       res.status(400).json({ 
@@ -161,13 +194,21 @@ exports.createStripeCustomer = functions.https.onRequest(async (req, res) => {
       return;
     }
 
-    // 4. Create Stripe customer
-    const customer = await createCustomer(email, uid);
+    // 5. Create Stripe customer
+    const customer = await createCustomer(
+      email,
+      uid,
+      requestId ? `customer-${uid}-${requestId}` : null
+    );
 
-    // 5. Create metered subscription
-    const { subscription, subscriptionItem } = await createMeteredSubscription(customer.id);
+    // 6. Create metered subscription
+    const { subscription, subscriptionItem } = await createMeteredSubscription(
+      customer.id,
+      null,
+      requestId ? `subscription-${uid}-${requestId}` : null
+    );
 
-    // 6. Store Stripe info in Firestore
+    // 7. Store Stripe info in Firestore
     await setStripeInfo(
       uid,
       customer.id,
@@ -175,7 +216,7 @@ exports.createStripeCustomer = functions.https.onRequest(async (req, res) => {
       subscriptionItem.id
     );
 
-    // 7. Return customer and subscription info
+    // 8. Return customer and subscription info
     res.status(200).json({
       customer: {
         id: customer.id,
@@ -223,11 +264,7 @@ exports.stripeWebhook = functions.https.onRequest(async (req, res) => {
     return;
   }
 
-  // Get webhook secret from environment
-  const webhookSecret = process.env.STRIPE_WEBHOOK_SECRET || 
-                       functions.config().stripe?.webhook_secret;
-
-  if (!webhookSecret) {
+  if (!STRIPE_WEBHOOK_SECRET) {
     console.error('STRIPE_WEBHOOK_SECRET not configured');
     res.status(500).json({ error: 'Webhook secret not configured' });
     return;
@@ -240,7 +277,7 @@ exports.stripeWebhook = functions.https.onRequest(async (req, res) => {
     // req.rawBody is available in Firebase Functions v1
     // For v2, you'd need to use express.raw() middleware
     const rawBody = req.rawBody || JSON.stringify(req.body);
-    event = stripe.webhooks.constructEvent(rawBody, sig, webhookSecret);
+    event = stripe.webhooks.constructEvent(rawBody, sig, STRIPE_WEBHOOK_SECRET);
   } catch (err) {
     console.error('Webhook signature verification failed:', err.message);
     res.status(400).json({ error: `Webhook Error: ${err.message}` });
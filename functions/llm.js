@@ -3,7 +3,6 @@
  * Handles communication with LLM providers (OpenAI by default)
  */
 
-const OpenAI = require('openai');
 const functions = require('firebase-functions');
 
 // Get OpenAI API key from environment
@@ -14,12 +13,24 @@ if (!OPENAI_KEY) {
   console.warn('Warning: OPENAI_KEY not set. LLM functions will fail.');
 }
 
-// Initialize OpenAI client
+// OpenAI client, created on first use and reused across requests
+// The SDK is only loaded when an LLM call is made, keeping cold starts of
+// the billing-only functions cheap
 let openaiClient = null;
-if (OPENAI_KEY) {
-  openaiClient = new OpenAI({
-    apiKey: OPENAI_KEY
-  });
+
+/**
+ * Gets the shared OpenAI client, creating it on first call
+ * @returns {object|null} - OpenAI client or null if OPENAI_KEY is not set
+ */
+function getOpenAIClient() {
+  if (!openaiClient && OPENAI_KEY) {
+    const OpenAI = require('openai');
+    openaiClient = new OpenAI({
+      apiKey: OPENAI_KEY
+    });
+  }
+
+  return openaiClient;
 }
 
 /**
@@ -37,14 +48,16 @@ function getDefaultModel() {
  * @returns {Promise<{output: string, tokensUsed: number}>} - Response and token usage
  */
 async function callOpenAI(prompt, model = null) {
-  if (!openaiClient) {
+  const client = getOpenAIClient();
+
+  if (!client) {
     throw new Error('OpenAI client not initialized. Check OPENAI_KEY configuration.');
   }
 
   const modelToUse = model || getDefaultModel();
 
   try {
-    const response = await openaiClient.chat.completions.create({
+    const response = await client.chat.completions.create({
       model: modelToUse,
       messages: [
         {
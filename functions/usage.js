@@ -3,7 +3,7 @@
  * Handles Firestore operations for usage records
  */
 
-const { db } = require('./firebase');
+const firebase = require('./firebase');
 
 const USAGE_COLLECTION = 'usage';
 
@@ -22,7 +22,7 @@ async function logUsage(uid, tokens, model) {
   };
 
   // Store in usage/{uid}/records/{autoId}
-  const usageRef = await db
+  const usageRef = await firebase.db
     .collection(USAGE_COLLECTION)
     .doc(uid)
     .collection('records')
@@ -41,7 +41,7 @@ async function logUsage(uid, tokens, model) {
  * @returns {Promise<Array>} - Array of usage records
  */
 async function getUserUsage(uid, limit = 100) {
-  const snapshot = await db
+  const snapshot = await firebase.db
     .collection(USAGE_COLLECTION)
     .doc(uid)
     .collection('records')
@@ -61,18 +61,18 @@ async function getUserUsage(uid, limit = 100) {
  * @returns {Promise<number>} - Total tokens used
  */
 async function getTotalUsage(uid) {
-  const snapshot = await db
+  // Required here so loading this module doesn't pull in Firestore
+  const { AggregateField } = require('firebase-admin/firestore');
+
+  // Sum on the server instead of downloading every record
+  const snapshot = await firebase.db
     .collection(USAGE_COLLECTION)
     .doc(uid)
     .collection('records')
+    .aggregate({ total: AggregateField.sum('tokens') })
     .get();
 
-  let total = 0;
-  snapshot.docs.forEach(doc => {
-    total += doc.data().tokens || 0;
-  });
-
-  return total;
+  return snapshot.data().total || 0;
 }
 
 module.exports = {
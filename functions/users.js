@@ -3,17 +3,22 @@
  * Handles Firestore operations for user documents
  */
 
-const { db } = require('./firebase');
+const firebase = require('./firebase');
 
 const USERS_COLLECTION = 'users';
 
+// In-memory cache of user documents, reused across requests on a warm instance
+const USER_CACHE_TTL_MS = 60 * 1000;
+const USER_CACHE_MAX_ENTRIES = 1000;
+const userCache = new Map();
+
 /**
  * Gets user document from Firestore
  * @param {string} uid - User ID
  * @returns {Promise<object|null>} - User document or null if not found
  */
 async function getUser(uid) {
-  const userDoc = await db.collection(USERS_COLLECTION).doc(uid).get();
+  const userDoc = await firebase.db.collection(USERS_COLLECTION).doc(uid).get();
   
   if (!userDoc.exists) {
     return null;
@@ -25,6 +30,42 @@ async function getUser(uid) {
   };
 }
 
+/**
+ * Gets user document, served from the in-memory cache when fresh
+ * Only users with a subscription item are cached, so a user who signs up
+ * (usually on another function instance) is picked up on the next call
+ * Invalidation in createUser/updateUser only affects this instance's cache
+ * @param {string} uid - User ID
+ * @returns {Promise<object|null>} - User document or null if not found
+ */
+async function getCachedUser(uid) {
+  const now = Date.now();
+  const cached = userCache.get(uid);
+
+  if (cached && cached.expiresAt > now) {
+    // Re-insert so the Map stays ordered by most recent use
+    userCache.delete(uid);
+    userCache.set(uid, cached);
+    return cached.user;
+  }
+
+  const user = await getUser(uid);
+
+  userCache.delete(uid);
+  if (user?.subscriptionItemId) {
+    if (userCache.size >= USER_CACHE_MAX_ENTRIES) {
+      // Evict the least recently used entry
+      userCache.delete(userCache.keys().next().value);
+    }
+    userCache.set(uid, {
+      user,
+      expiresAt: now + USER_CACHE_TTL_MS
+    });
+  }
+
+  return user;
+}
+
 /**
  * Creates a new user document in Firestore
  * @param {string} uid - User ID
@@ -32,13 +73,22 @@ async function getUser(uid) {
  * @returns {Promise<object>} - Created user document
  */
 async function createUser(uid, userData) {
-  await db.collection(USERS_COLLECTION).doc(uid).set({
+  const now = Date.now();
+
+  const data = {
     ...userData,
-    createdAt: Date.now(),
-    updatedAt: Date.now()
-  });
+    createdAt: now,
+    updatedAt: now
+  };
+
+  userCache.delete(uid);
+  // set() replaces the whole document, so the written data is the document
+  await firebase.db.collection(USERS_COLLECTION).doc(uid).set(data);
   
-  return getUser(uid);
+  return {
+    id: uid,
+    ...data
+  };
 }
 
 /**
@@ -48,7 +98,8 @@ async function createUser(uid, userData) {
  * @returns {Promise<object>} - Updated user document
  */
 async function updateUser(uid, updates) {
-  await db.collection(USERS_COLLECTION).doc(uid).update({
+  userCache.delete(uid);
+  await firebase.db.collection(USERS_COLLECTION).doc(uid).update({
     ...updates,
     updatedAt: Date.now()
   });
@@ -84,6 +135,7 @@ async function getSubscriptionItemId(uid) {
 
 module.exports = {
   getUser,
+  getCachedUser,
   createUser,
   updateUser,
   setStripeInfo,